@@ -2,158 +2,321 @@
 Clean and optimize conversation logs to reduce token usage.
 """
 
+import hashlib
 import json
 import logging
+import os
 import shutil
+import sys
+from collections.abc import Generator, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import groupby, repeat
 from pathlib import Path
-from typing import Generator
 
-from .logmanager import LogManager
+from rich.progress import track
+
+from .logmanager import Log, LogManager
 from .message import Message, len_tokens
 from .util import console
 
 logger = logging.getLogger(__name__)
 
-def clean_log(manager: LogManager) -> Generator[Message, None, None]:
-    """Clean a single conversation log to reduce token usage."""
-    # Create a backup of the current log
-    backup_file = manager.logfile.parent / "conversation.backup.jsonl"
-    shutil.copy(manager.logfile, backup_file)
 
-    # Get token count before cleaning
-    original_tokens = len_tokens(manager.log.messages)
-    console.log(f"Token count before cleaning: {original_tokens}")
+# Keyword rules for system messages as (keyword, keep, max length), checked in order.
+# The first matching rule decides whether the message is kept.
+# NOTE: plain substring checks benchmark ~3x faster than one compiled alternation regex
+_SYSTEM_MESSAGE_RULES: tuple[tuple[str, bool, int | None], ...] = (
+    ("Error:", True, None),
+    ("Successfully", False, None),  # Skip success messages
+    ("No output", False, None),  # Skip empty output messages
+    ("Executed command", False, 50),  # Skip short command acknowledgments
+)
 
-    cleaned_entries = []
-    seen_entries = set()
-    stats = {"user": 0, "assistant": 0, "system": 0, "duplicates": 0}
 
-    # Always keep the first system message (initialization)
-    if manager.log.messages and manager.log.messages[0].role == "system":
-        cleaned_entries.append(manager.log.messages[0])
-        stats["system"] += 1
-
-    def should_keep_system_message(msg: Message) -> bool:
-        """Determine if a system message should be kept."""
-        if msg.hide or msg.pinned:
-            return True
-        if "Error:" in msg.content:
-            return True
-        if "Successfully" in msg.content:
-            return False  # Skip success messages
-        if "No output" in msg.content:
-            return False  # Skip empty output messages
-        if "Executed command" in msg.content and len(msg.content) < 50:
-            return False  # Skip short command acknowledgments
+def _should_keep_system_message(msg: Message) -> bool:
+    """Determine if a system message should be kept."""
+    if msg.hide or msg.pinned:
         return True
+    content = msg.content
+    for keyword, keep, max_len in _SYSTEM_MESSAGE_RULES:
+        if keyword in content and (max_len is None or len(content) < max_len):
+            return keep
+    return True
 
-    # Process each message
-    i = 1  # Skip first message as we handled it
-    while i < len(manager.log.messages):
-        msg = manager.log.messages[i]
-        
-        if msg.role in ['user', 'assistant']:
-            # Create a tuple of role and content for deduplication
-            entry_key = (msg.role, msg.content.strip())
-            if entry_key not in seen_entries:
-                cleaned_entries.append(msg)
-                seen_entries.add(entry_key)
-                stats[msg.role] += 1
-            else:
-                stats["duplicates"] += 1
-        
-        # Handle system messages
-        elif msg.role == 'system':
-            if should_keep_system_message(msg):
-                if 'Ran command' in msg.content:
-                    # Try to combine command and its output
-                    command = msg.content.split('Ran command:')[1].strip()
-                    command_key = ('system', command)
-                    
-                    if command_key not in seen_entries:
-                        # Look ahead for related messages
-                        combined_content = [f"Command: {command}"]
-                        j = i + 1
-                        while j < len(manager.log.messages):
-                            next_msg = manager.log.messages[j]
-                            if next_msg.role != 'system':
-                                break
-                            if 'stdout' in next_msg.content:
-                                output = next_msg.content.strip()
-                                if len(output) > 500:  # Truncate long outputs
-                                    output = output[:500] + "... (truncated)"
-                                combined_content.append(f"Output: {output}")
-                                j += 1
-                            elif 'stderr' in next_msg.content:
-                                combined_content.append(f"Error: {next_msg.content.strip()}")
-                                j += 1
-                            else:
-                                break
-                        
-                        cleaned_msg = Message(
-                            "system",
-                            " | ".join(combined_content),
-                            hide=msg.hide,
-                            files=msg.files,
-                            quiet=msg.quiet,
-                            pinned=msg.pinned
-                        )
-                        cleaned_entries.append(cleaned_msg)
-                        seen_entries.add(command_key)
-                        stats["system"] += 1
-                        i = j - 1  # Skip the messages we combined
-                    else:
-                        stats["duplicates"] += 1
+
+@dataclass(slots=True)
+class CleanStats:
+    """Number of messages kept per role, and of duplicates removed, when cleaning a log."""
+
+    user: int = 0
+    assistant: int = 0
+    system: int = 0
+    duplicates: int = 0
+
+
+# ioctl request to clone the extents of a file into another, from linux/fs.h
+_FICLONE = 0x40049409
+
+
+def _copy_file(src: Path, dst: Path) -> None:
+    """
+    Copy a file as a copy-on-write clone, where the filesystem supports it (btrfs, XFS, APFS).
+
+    Falls back to a regular copy otherwise.
+    """
+    try:
+        if sys.platform == "linux":
+            import fcntl  # fmt: skip
+
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copymode(src, dst)
+            return
+        elif sys.platform == "darwin":
+            import ctypes  # fmt: skip
+
+            libc = ctypes.CDLL("libSystem.dylib", use_errno=True)
+            # clonefile fails if the destination exists
+            dst.unlink(missing_ok=True)
+            if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+                return
+    except OSError:
+        pass
+    shutil.copy(src, dst)
+
+
+def _entry_key(role: str, content: str) -> bytes:
+    """Digest of a message for deduplication, so we don't hold a copy of every message's text."""
+    return hashlib.blake2b(
+        content.encode(), digest_size=16, person=role.encode()
+    ).digest()
+
+
+@dataclass(slots=True)
+class _CommandGroup:
+    """A "Ran command" message and the output of the messages following it."""
+
+    src: Message
+    command: str
+    outputs: list[str] = field(default_factory=list)
+
+    def finalize(self) -> Message:
+        """Returns the combined message, or the original message if there was no output."""
+        if not self.outputs:
+            return self.src
+        return Message(
+            "system",
+            " | ".join([f"Command: {self.command}", *self.outputs]),
+            hide=self.src.hide,
+            files=self.src.files,
+            quiet=self.src.quiet,
+            pinned=self.src.pinned,
+        )
+
+
+def _clean_messages(
+    msgs: Iterable[Message], stats: CleanStats
+) -> Generator[Message, None, None]:
+    """
+    Deduplicate messages and merge commands with their output, in a single pass.
+
+    Messages are walked in runs of the same role, so a command group (a "Ran command"
+    message followed by its stdout/stderr) can only span a run of system messages,
+    and is flushed when the run ends.
+    """
+    seen_entries: set[bytes] = set()
+    for role, run in groupby(msgs, key=lambda msg: msg.role):
+        if role in ["user", "assistant"]:
+            kept = 0
+            for msg in run:
+                entry_key = _entry_key(role, msg.stripped_content)
+                if entry_key not in seen_entries:
+                    seen_entries.add(entry_key)
+                    kept += 1
+                    yield msg
                 else:
-                    cleaned_entries.append(msg)
-                    stats["system"] += 1
-        
-        i += 1
-
-    # Log statistics
-    console.log(f"Messages processed:")
-    console.log(f"  User messages kept: {stats['user']}")
-    console.log(f"  Assistant messages kept: {stats['assistant']}")
-    console.log(f"  System messages kept: {stats['system']}")
-    console.log(f"  Duplicate messages removed: {stats['duplicates']}")
+                    stats.duplicates += 1
+            if role == "user":
+                stats.user += kept
+            else:
+                stats.assistant += kept
+            continue
+        if role != "system":
+            continue
+
+        # The command group currently being combined
+        group: _CommandGroup | None = None
+        for msg in run:
+            if group:
+                if "stdout" in msg.content:
+                    output = msg.stripped_content
+                    if len(output) > 500:  # Truncate long outputs
+                        output = output[:500] + "... (truncated)"
+                    group.outputs.append(f"Output: {output}")
+                    continue
+                elif "stderr" in msg.content:
+                    group.outputs.append(f"Error: {msg.stripped_content}")
+                    continue
+                yield group.finalize()
+                group = None
+
+            if not _should_keep_system_message(msg):
+                continue
+            if "Ran command" in msg.content:
+                # Try to combine command and its output
+                _, _, command = msg.content.partition("Ran command:")
+                command = command.strip()
+                command_key = _entry_key("system", command)
+                if command_key in seen_entries:
+                    stats.duplicates += 1
+                    continue
+                seen_entries.add(command_key)
+                stats.system += 1
+                group = _CommandGroup(msg, command)
+            else:
+                stats.system += 1
+                yield msg
+
+        if group:
+            yield group.finalize()
+
+
+def _clean_log_messages(
+    msgs: Iterable[Message], stats: CleanStats
+) -> Generator[Message, None, None]:
+    """Clean the messages of a whole log, including its initial system prompt."""
+    msgs = iter(msgs)
+    first = next(msgs, None)
+
+    # Always keep the first system message (initialization)
+    if first and first.role == "system":
+        stats.system += 1
+        yield first
+
+    # Process each message, skipping the first one as we handled it
+    yield from _clean_messages(msgs, stats)
+
+
+def _clean(manager: LogManager, model: str) -> tuple[int, int, CleanStats]:
+    """
+    Clean a conversation log in place, without printing anything.
+
+    Returns the token counts before and after cleaning, and the message stats.
+    """
+    # Create a backup of the current log
+    backup_file = manager.logfile.parent / "conversation.backup.jsonl"
+    _copy_file(manager.logfile, backup_file)
+
+    # Get token count before cleaning
+    original_tokens = len_tokens(manager.log.messages, model)
+
+    stats = CleanStats()
+    cleaned_entries = list(_clean_log_messages(manager.log.messages, stats))
 
     # Create a new log with cleaned entries
     manager.edit(cleaned_entries)
 
     # Get token count after cleaning
-    cleaned_tokens = len_tokens(manager.log.messages)
+    # kept messages hit the token cache populated by the count above
+    cleaned_tokens = len_tokens(manager.log.messages, model)
+    return original_tokens, cleaned_tokens, stats
+
+
+def _clean_one(directory: Path, model: str) -> tuple[int, int]:
+    """
+    Clean the log of a conversation directory, returns the token counts before and after.
+
+    Streams the log from disk and writes kept messages as they are produced,
+    so only the messages of the current command group are held in memory
+    (besides fixed-size digests, for deduplication and cached token counts).
+    """
+    # NOTE: runs in a worker process, and there is no live LogManager to keep in sync,
+    #       so we don't need to load the whole log (and its branches) into one.
+    logfile = directory / "conversation.jsonl"
+    backup_file = directory / "conversation.backup.jsonl"
+    cleaned_file = directory / "conversation.cleaned.jsonl"
+    _copy_file(logfile, backup_file)
+
+    original_tokens = 0
+    cleaned_tokens = 0
+
+    def count_tokens(msgs: Iterable[Message]) -> Generator[Message, None, None]:
+        nonlocal original_tokens
+        for msg in msgs:
+            original_tokens += len_tokens(msg, model)
+            yield msg
+
+    stats = CleanStats()
+    try:
+        with open(cleaned_file, "w") as file:
+            for msg in _clean_log_messages(count_tokens(Log.iter_jsonl(logfile)), stats):
+                cleaned_tokens += len_tokens(msg, model)
+                file.write(json.dumps(msg.to_dict()) + "\n")
+
+        # Save the log as an edit branch, like LogManager.edit() does, so the cleaning can be undone
+        branches_dir = directory / "branches"
+        branches_dir.mkdir(parents=True, exist_ok=True)
+        n = len(list(branches_dir.glob("main-edit-*.jsonl")))
+        _copy_file(logfile, branches_dir / f"main-edit-{n}.jsonl")
+
+        os.replace(cleaned_file, logfile)
+    except BaseException:
+        # don't leave a half-written log behind
+        cleaned_file.unlink(missing_ok=True)
+        raise
+    return original_tokens, cleaned_tokens
+
+
+def clean_log(manager: LogManager, model: str = "gpt-4") -> Generator[Message, None, None]:
+    """Clean a single conversation log to reduce token usage."""
+    original_tokens, cleaned_tokens, stats = _clean(manager, model)
     tokens_saved = original_tokens - cleaned_tokens
-    console.log(f"Token count after cleaning: {cleaned_tokens}")
-    console.log(f"Tokens saved: {tokens_saved} ({(tokens_saved/original_tokens)*100:.1f}%)")
+
+    # Log statistics, in a single call
+    console.log(
+        f"Token count before cleaning: {original_tokens}\n"
+        f"Messages processed:\n"
+        f"  User messages kept: {stats.user}\n"
+        f"  Assistant messages kept: {stats.assistant}\n"
+        f"  System messages kept: {stats.system}\n"
+        f"  Duplicate messages removed: {stats.duplicates}\n"
+        f"Token count after cleaning: {cleaned_tokens}\n"
+        f"Tokens saved: {tokens_saved} ({(tokens_saved/original_tokens)*100:.1f}%)"
+    )
 
     yield Message(
         "system",
         f"Cleaned conversation log. Tokens saved: {tokens_saved} ({(tokens_saved/original_tokens)*100:.1f}%)"
     )
 
-def clean_all_logs(logs_dir: Path) -> Generator[Message, None, None]:
+
+def clean_all_logs(logs_dir: Path, model: str = "gpt-4") -> Generator[Message, None, None]:
     """Clean all conversation logs in the logs directory."""
     total_tokens_saved = 0
     total_original_tokens = 0
-    
+
     # Get all conversation directories
-    directories = sorted(logs_dir.iterdir(), key=lambda d: d.name, reverse=True)
-    for directory in directories:
-        if directory.is_dir() and (directory / "conversation.jsonl").exists():
-            console.log(f"\nCleaning {directory.name}...")
-            manager = LogManager.load(directory)
-            
-            # Get token counts before cleaning
-            original_tokens = len_tokens(manager.log.messages)
-            total_original_tokens += original_tokens
-            
-            # Clean the log
-            for msg in clean_log(manager):
-                pass  # Consume the generator
-            
-            # Calculate tokens saved
-            cleaned_tokens = len_tokens(manager.log.messages)
+    directories = [
+        directory
+        for directory in sorted(logs_dir.iterdir(), key=lambda d: d.name, reverse=True)
+        if directory.is_dir() and (directory / "conversation.jsonl").exists()
+    ]
+
+    # Conversations are independent, so clean them in parallel worker processes
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(
+            _clean_one, directories, repeat(model, len(directories)), chunksize=4
+        )
+        for directory, (original_tokens, cleaned_tokens) in track(
+            zip(directories, results),
+            description="Cleaning logs...",
+            total=len(directories),
+            console=console,
+        ):
             tokens_saved = original_tokens - cleaned_tokens
+            console.log(f"Cleaned {directory.name}: {tokens_saved} tokens saved")
+            total_original_tokens += original_tokens
             total_tokens_saved += tokens_saved
 
     if total_original_tokens > 0:
@@ -2,16 +2,18 @@
 Command handling for the CLI.
 """
 
+import ast
 import logging
-import re
+import os
 import sys
 from collections.abc import Generator
+from graphlib import CycleError, TopologicalSorter
+from importlib.util import resolve_name
 from pathlib import Path
-from time import sleep
+from time import sleep, time
+from types import ModuleType
 from typing import Literal
 
-from . import llm
-from .export import export_chat_to_html
 from .logmanager import LogManager, prepare_messages
 from .message import (
     Message,
@@ -88,7 +90,7 @@ def handle_cmd(
     """Handles a command."""
     cmd = cmd.lstrip("/")
     logger.debug(f"Executing command: {cmd}")
-    name, *args = re.split(r"[\n\s]", cmd)
+    name, *args = cmd.split() or [""]
     full_args = cmd.split(" ", 1)[1] if " " in cmd else ""
     match name:
         case "profile":
@@ -102,29 +104,26 @@ def handle_cmd(
                 yield Message("system", "No profile data found. Run gptme with --profile flag first.")
                 return
                 
-            import pstats
             from io import StringIO
-            from contextlib import redirect_stdout
+            from .profiling import load_stats
 
             try:
                 # Create a string buffer to capture output
                 output = StringIO()
-                
-                # Redirect stdout to our string buffer
-                with redirect_stdout(output):
-                    # Create Stats object with string path
-                    stats = pstats.Stats(str(profile_path.absolute()))
-                    stats.strip_dirs()
-                    
-                    # Print different views of the profile data
-                    print("\n=== Top 20 Functions by Cumulative Time ===")
-                    stats.sort_stats('cumulative')
-                    stats.print_stats(20)
-                    
-                    print("\n=== Top 20 Functions by Call Count ===")
-                    stats.sort_stats('calls')
-                    stats.print_stats(20)
-                
+
+                # Reuses the parsed stats if the profile hasn't changed since last time
+                stats = load_stats(profile_path)
+                stats.stream = output
+
+                # Print different views of the profile data
+                print("\n=== Top 20 Functions by Cumulative Time ===", file=output)
+                stats.sort_stats('cumulative')
+                stats.print_stats(20)
+
+                print("\n=== Top 20 Functions by Call Count ===", file=output)
+                stats.sort_stats('calls')
+                stats.print_stats(20)
+
                 # Get the complete output
                 yield Message("system", output.getvalue())
             except Exception as e:
@@ -135,6 +134,7 @@ def handle_cmd(
             manager.undo(1, quiet=True)
             
             from .clean_logs import clean_log, clean_all_logs
+            from .dirs import get_logs_dir
             
             # Check if --all flag is present
             if "--all" in args:
@@ -163,9 +163,11 @@ def handle_cmd(
             new_name = args[0] if args else input("New name: ")
             manager.fork(new_name)
         case "summarize":
+            from .llm import summarize
+
             msgs = prepare_messages(manager.log.messages)
             msgs = [m for m in msgs if not m.hide]
-            summary = llm.summarize(msgs)
+            summary = summarize(msgs)
             print(f"Summary: {summary}")
         case "edit":
             # edit previous messages
@@ -197,7 +199,7 @@ def handle_cmd(
             yield from execute_msg(msg, confirm=lambda _: True)
         case "tokens":
             manager.undo(1, quiet=True)
-            n_tokens = len_tokens(manager.log.messages)
+            n_tokens = manager.cached_len_tokens()
             print(f"Tokens used: {n_tokens}")
             model = get_model()
             if model:
@@ -222,6 +224,8 @@ def handle_cmd(
                 Path(args[0]) if args else Path(f"{manager.logfile.parent.name}.html")
             )
             # Export the chat
+            from .export import export_chat_to_html
+
             export_chat_to_html(manager.name, manager.log, output_path)
             print(f"Exported conversation to {output_path}")
         case "reload":
@@ -243,19 +247,11 @@ def handle_cmd(
             import gptme
             package_name = gptme.__name__
             
-            # Get all loaded modules that are part of our package
-            import sys
-            modules_to_reload = [
-                mod for name, mod in sys.modules.items()
-                if name.startswith(package_name + ".")
-            ]
-            
-            # Sort modules to ensure proper reload order
-            modules_to_reload.sort(
-                key=lambda mod: len(mod.__name__.split("."))
-            )
-            
-            # Reload all modules
+            # Get the changed modules of our package, and the modules depending on them,
+            # in dependency order
+            modules_to_reload = _modules_to_reload(package_name)
+
+            # Reload changed modules
             import importlib
             for module in modules_to_reload:
                 try:
@@ -263,6 +259,8 @@ def handle_cmd(
                 except Exception as e:
                     yield Message("system", f"Error reloading {module.__name__}: {e}")
                     return
+                _reload_mtimes[module.__name__] = _source_mtime(module)
+                _reload_deps[module.__name__] = _module_deps(module, package_name)
             
             try:
                 # Reload the main package
@@ -283,7 +281,13 @@ def handle_cmd(
                 init_tools(current_tools)
                 init(current_model.model if current_model else None, True, current_tools)
                 
-                yield Message("system", "Successfully reloaded all modules")
+                if modules_to_reload:
+                    yield Message(
+                        "system",
+                        f"Successfully reloaded {len(modules_to_reload)} changed or dependent modules",
+                    )
+                else:
+                    yield Message("system", "No modules changed, reinitialized")
             except Exception as e:
                 yield Message("system", f"Error during reinitialization: {e}")
                 # Try to recover by reinitializing with defaults
@@ -308,6 +312,131 @@ def handle_cmd(
                     print("Unknown command")
 
 
+# State for the "reload" command, kept across reloads of this module.
+# Time this module was first loaded, used as the load time of modules not yet reloaded.
+_loaded_at: float = globals().get("_loaded_at", time())
+# Source mtimes of modules as of their last reload.
+_reload_mtimes: dict[str, float] = globals().get("_reload_mtimes", {})
+# Package modules each module depends on, as found in its namespace.
+_reload_deps: dict[str, set[str]] = globals().get("_reload_deps", {})
+
+
+def _source_mtime(module: ModuleType) -> float:
+    try:
+        return os.stat(module.__file__).st_mtime if module.__file__ else 0
+    except (AttributeError, OSError):
+        return 0
+
+
+def _imported_modules(module: ModuleType) -> set[str]:
+    """
+    Returns the names imported at the top level of a module, as absolute dotted names.
+
+    For `from x import y` both `x` and `x.y` are included, as `y` may be a submodule.
+    """
+    try:
+        tree = ast.parse(Path(module.__file__).read_text())  # type: ignore
+    except (TypeError, OSError, SyntaxError, ValueError):
+        return set()
+
+    names = set()
+    # walk top-level statements, including those in if/try blocks (like optional imports),
+    # but not function bodies, as those imports are resolved on each call
+    stmts: list[ast.AST] = list(tree.body)
+    while stmts:
+        stmt = stmts.pop()
+        if isinstance(stmt, ast.Import):
+            names.update(alias.name for alias in stmt.names)
+        elif isinstance(stmt, ast.ImportFrom):
+            if stmt.level:
+                if not module.__package__:
+                    continue
+                base = resolve_name(
+                    "." * stmt.level + (stmt.module or ""), module.__package__
+                )
+            else:
+                base = stmt.module or ""
+            names.add(base)
+            names.update(f"{base}.{alias.name}" for alias in stmt.names)
+        elif isinstance(stmt, ast.If) and "TYPE_CHECKING" in ast.unparse(stmt.test):
+            # type-only imports aren't dependencies at runtime
+            stmts.extend(stmt.orelse)
+        elif isinstance(stmt, ast.If | ast.Try | ast.With):
+            for child in ast.iter_child_nodes(stmt):
+                if isinstance(child, ast.stmt):
+                    stmts.append(child)
+                elif isinstance(child, ast.ExceptHandler):
+                    stmts.extend(child.body)
+    return names
+
+
+def _module_deps(module: ModuleType, package_name: str) -> set[str]:
+    """
+    Returns the names of the package modules that a module depends on.
+
+    Found from the objects in its namespace that are defined in package modules,
+    and from its imports, which also catches imported data (like lists) that has no `__module__`.
+    """
+    names = _imported_modules(module)
+    for value in list(vars(module).values()):
+        if isinstance(value, ModuleType):
+            names.add(value.__name__)
+        else:
+            name = getattr(value, "__module__", None)
+            if isinstance(name, str):
+                names.add(name)
+    return {
+        name
+        for name in names
+        if name.startswith(package_name + ".")
+        and name != module.__name__
+        and name in sys.modules
+    }
+
+
+def _modules_to_reload(package_name: str) -> list[ModuleType]:
+    """
+    Returns the package modules that need reloading, in dependency order.
+
+    A module needs reloading if its source changed since it was last loaded,
+    or if any module it depends on is reloaded.
+    """
+    modules = {
+        name: mod
+        for name, mod in sys.modules.items()
+        if name.startswith(package_name + ".") and mod is not None
+    }
+    for name, mod in modules.items():
+        if name not in _reload_deps:
+            _reload_deps[name] = _module_deps(mod, package_name)
+    graph = {name: _reload_deps[name] & modules.keys() for name in modules}
+
+    try:
+        order = list(TopologicalSorter(graph).static_order())
+    except CycleError:
+        # submodules importing from their own package (like `from . import ToolSpec` in tools)
+        # form cycles with the package importing them, so drop those edges and reload the
+        # package after its submodules
+        graph = {
+            name: {dep for dep in deps if not name.startswith(dep + ".")}
+            for name, deps in graph.items()
+        }
+        try:
+            order = list(TopologicalSorter(graph).static_order())
+        except CycleError:
+            # can't order circular imports, reload everything with parents before children
+            return sorted(modules.values(), key=lambda mod: len(mod.__name__.split(".")))
+
+    changed: set[str] = set()
+    for name in order:
+        if (
+            _source_mtime(modules[name]) > _reload_mtimes.get(name, _loaded_at)
+            or graph[name] & changed
+        ):
+            changed.add(name)
+    return [modules[name] for name in order if name in changed]
+
+
 def edit(manager: LogManager) -> Generator[Message, None, None]:  # pragma: no cover
     # generate editable toml of all messages
     t = msgs_to_toml(reversed(manager.log))  # type: ignore
@@ -329,8 +458,10 @@ def edit(manager: LogManager) -> Generator[Message, None, None]:  # pragma: no c
 
 def rename(manager: LogManager, new_name: str, confirm: ConfirmFunc) -> None:
     if new_name in ["", "auto"]:
+        from .llm import generate_name
+
         msgs = prepare_messages(manager.log.messages)[1:]  # skip system message
-        new_name = llm.generate_name(msgs)
+        new_name = generate_name(msgs)
         assert " " not in new_name, f"Invalid name: {new_name}"
         print(f"Generated name: {new_name}")
         if not confirm("Confirm?"):
@@ -342,11 +473,22 @@ def rename(manager: LogManager, new_name: str, confirm: ConfirmFunc) -> None:
     print(f"Renamed conversation to {manager.logfile.parent}")
 
 
+# help lines for the commands, invariant so built once at import
+_max_cmdlen = max(len(cmd) for cmd in COMMANDS)
+_help_cmd_lines = tuple(
+    f"  /{cmd.ljust(_max_cmdlen)}  {desc}" for cmd, desc in action_descriptions.items()
+)
+
+# help lines for the langtags of loaded tools, along with the number of tools they were built for
+# (tools are loaded after import, and only ever appended to loaded_tools)
+_help_langtag_lines: tuple[int, tuple[str, ...]] | None = None
+
+
 def _gen_help(incl_langtags: bool = True) -> Generator[str, None, None]:
+    global _help_langtag_lines
+
     yield "Available commands:"
-    max_cmdlen = max(len(cmd) for cmd in COMMANDS)
-    for cmd, desc in action_descriptions.items():
-        yield f"  /{cmd.ljust(max_cmdlen)}  {desc}"
+    yield from _help_cmd_lines
 
     if incl_langtags:
         yield ""
@@ -358,13 +500,21 @@ def _gen_help(incl_langtags: bool = True) -> Generator[str, None, None]:
         yield "  /python print('hello')"
         yield ""
         yield "Supported langtags:"
-        for tool in loaded_tools:
-            if tool.block_types:
-                yield f"  - {tool.block_types[0]}" + (
-                    f"  (alias: {', '.join(tool.block_types[1:])})"
-                    if len(tool.block_types) > 1
-                    else ""
-                )
+        if not _help_langtag_lines or _help_langtag_lines[0] != len(loaded_tools):
+            _help_langtag_lines = (
+                len(loaded_tools),
+                tuple(
+                    f"  - {tool.block_types[0]}"
+                    + (
+                        f"  (alias: {', '.join(tool.block_types[1:])})"
+                        if len(tool.block_types) > 1
+                        else ""
+                    )
+                    for tool in loaded_tools
+                    if tool.block_types
+                ),
+            )
+        yield from _help_langtag_lines[1]
 
 
 def help():
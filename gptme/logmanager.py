@@ -53,6 +53,11 @@ class Log:
             gen = islice(gen, limit)  # type: ignore
         return Log(list(gen))
 
+    @classmethod
+    def iter_jsonl(cls, path: PathLike) -> Generator[Message, None, None]:
+        """Reads messages one at a time, without loading the whole log into memory."""
+        yield from _gen_read_jsonl(path)
+
     def write_jsonl(self, path: PathLike) -> None:
         with open(path, "w") as file:
             for msg in self.messages:
@@ -82,6 +87,9 @@ class LogManager:
             self.logdir = Path(fpath)
         self.name = self.logdir.name
 
+        # token count of a log for a model, as (log, model, count), see cached_len_tokens()
+        self._token_count: tuple[Log, str, int] | None = None
+
         # load branches from adjacent files
         self._branches = {self.current_branch: Log(log or [])}
         if self.logdir / "conversation.jsonl":
@@ -117,11 +125,42 @@ class LogManager:
 
     def append(self, msg: Message) -> None:
         """Appends a message to the log, writes the log, prints the message."""
+        prev_log = self.log
         self.log = self.log.append(msg)
+        # keep the cached token count current by adding the tokens of the new message
+        if self._token_count and self._token_count[0] is prev_log:
+            _, model, count = self._token_count
+            self._token_count = (self.log, model, count + len_tokens(msg, model))
         self.write()
         if not msg.quiet:
             print_msg(msg, oneline=False)
 
+    def _pop(self) -> Message:
+        """Removes and returns the last message of the log, keeping the cached token count current."""
+        prev_log = self.log
+        msg = prev_log[-1]
+        self.log = prev_log.pop()
+        if self._token_count and self._token_count[0] is prev_log:
+            _, model, count = self._token_count
+            self._token_count = (self.log, model, count - len_tokens(msg, model))
+        return msg
+
+    def cached_len_tokens(self, model: str = "gpt-4") -> int:
+        """
+        Returns the number of tokens in the current log.
+
+        The count is reused until the log changes, and kept current on append and undo
+        by adding/subtracting the tokens of the appended/removed messages.
+        Other changes to the log (edit, switching branch) invalidate the count.
+        """
+        if self._token_count:
+            log, cached_model, count = self._token_count
+            if log is self.log and cached_model == model:
+                return count
+        count = len_tokens(self.log.messages, model)
+        self._token_count = (self.log, model, count)
+        return count
+
     def write(self, branches=True) -> None:
         """
         Writes to the conversation log.
@@ -162,7 +201,7 @@ class LogManager:
         """Removes the last message from the log."""
         undid = self.log[-1] if self.log else None
         if undid and undid.content.startswith("/undo"):
-            self.log = self.log.pop()
+            self._pop()
 
         # don't save backup branch if undoing a command
         if self.log and not self.log[-1].content.startswith("/"):
@@ -178,8 +217,7 @@ class LogManager:
         if not quiet:
             print("[yellow]Undoing messages:[/yellow]")
         for _ in range(n):
-            undid = self.log[-1]
-            self.log = self.log.pop()
+            undid = self._pop()
             if not quiet:
                 print(
                     f"[red]  {undid.role}: {textwrap.shorten(undid.content.strip(), width=50, placeholder='...')}[/]",
@@ -370,7 +408,7 @@ def get_user_conversations() -> Generator[ConversationMeta, None, None]:
 
 def _gen_read_jsonl(path: PathLike) -> Generator[Message, None, None]:
     with open(path) as file:
-        for line in file.readlines():
+        for line in file:
             json_data = json.loads(line)
             files = [Path(f) for f in json_data.pop("files", [])]
             if "timestamp" in json_data:
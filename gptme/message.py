@@ -1,9 +1,12 @@
 import base64
 import dataclasses
+import hashlib
 import logging
 import shutil
 import sys
 import textwrap
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
@@ -30,7 +33,7 @@ max_system_len = 20000
 ProvidersWithFiles: list[Provider] = ["openai", "anthropic", "openrouter"]
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(frozen=True, eq=False, slots=True)
 class Message:
     """
     A message in the assistant conversation.
@@ -53,6 +56,10 @@ class Message:
     quiet: bool = False
     timestamp: datetime = field(default_factory=datetime.now)
     files: list[Path] = field(default_factory=list)
+    # cache for stripped_content, a field since slots leave no __dict__ for cached_property
+    _stripped_content: str | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def __post_init__(self):
         assert isinstance(self.timestamp, datetime)
@@ -74,6 +81,13 @@ class Message:
             and self.timestamp == other.timestamp
         )
 
+    @property
+    def stripped_content(self) -> str:
+        """The content with surrounding whitespace stripped, computed once per message."""
+        if self._stripped_content is None:
+            object.__setattr__(self, "_stripped_content", self.content.strip())
+        return self._stripped_content  # type: ignore
+
     def replace(self, **kwargs) -> Self:
         """Replace attributes of the message."""
         return dataclasses.replace(self, **kwargs)
@@ -361,7 +375,52 @@ def msgs2dicts(msgs: list[Message], provider: Provider) -> list[dict]:
 def len_tokens(content: str | Message | list[Message], model: str = "gpt-4") -> int:
     """Get the number of tokens in a string, message, or list of messages."""
     if isinstance(content, list):
-        return sum(len_tokens(msg.content, model) for msg in content)
+        return sum(_count_tokens([msg.content for msg in content], model))
     if isinstance(content, Message):
-        return len_tokens(content.content, model)
-    return len(get_tokenizer(model).encode(content))
+        content = content.content
+    return _count_tokens([content], model)[0]
+
+
+# token counts by (content digest, model), so repeated passes over the same log don't re-tokenize every message
+# keyed on a digest so the cache doesn't keep the text of every counted message alive
+# least recently used entries are evicted once there are more than _token_counts_max
+_token_counts: OrderedDict[tuple[bytes, str], int] = OrderedDict()
+_token_counts_max = 10_000
+_token_counts_lock = threading.Lock()
+
+# below this many uncached strings, encoding one by one beats spinning up the batch thread pool
+_batch_min = 16
+
+
+def _count_tokens(contents: list[str], model: str) -> list[int]:
+    """Count the tokens of each string, batch-encoding the ones not already cached."""
+    keys = {
+        c: (hashlib.blake2b(c.encode(), digest_size=16).digest(), model)
+        for c in dict.fromkeys(contents)
+    }
+    counts: dict[str, int] = {}
+    misses: list[str] = []
+    # len_tokens is called from subagent and server threads, so the cache is only touched under the lock
+    with _token_counts_lock:
+        for c, key in keys.items():
+            count = _token_counts.get(key)
+            if count is None:
+                misses.append(c)
+            else:
+                _token_counts.move_to_end(key)
+                counts[c] = count
+
+    if misses:
+        # encode outside the lock, so other threads aren't blocked on tokenization
+        tokenizer = get_tokenizer(model)
+        if len(misses) < _batch_min:
+            encoded = [tokenizer.encode(c) for c in misses]
+        else:
+            encoded = tokenizer.encode_batch(misses)
+        with _token_counts_lock:
+            for c, tokens in zip(misses, encoded):
+                counts[c] = _token_counts[keys[c]] = len(tokens)
+            while len(_token_counts) > _token_counts_max:
+                _token_counts.popitem(last=False)
+
+    return [counts[c] for c in contents]
@@ -4,6 +4,7 @@ Profiling utilities for performance analysis
 
 import cProfile
 import pstats
+from io import StringIO
 from pathlib import Path
 from functools import wraps
 from typing import Callable, TypeVar, ParamSpec
@@ -11,6 +12,25 @@ from typing import Callable, TypeVar, ParamSpec
 P = ParamSpec('P')
 T = TypeVar('T')
 
+# Parsed profile stats, keyed by path, along with the mtime of the file when parsed
+_stats_cache: dict[str, tuple[float, pstats.Stats]] = {}
+
+def load_stats(profile_file: str | Path) -> pstats.Stats:
+    """
+    Load a profile file, reusing the parsed stats if the file hasn't changed.
+
+    The stats have their directories stripped. Set `stats.stream` before printing.
+    """
+    path = str(Path(profile_file).absolute())
+    mtime = Path(path).stat().st_mtime
+    cached = _stats_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    stats = pstats.Stats(path)
+    stats.strip_dirs()
+    _stats_cache[path] = (mtime, stats)
+    return stats
+
 def profile(output_file: str | Path) -> Callable[[Callable[P, T]], Callable[P, T]]:
     """
     Decorator to profile a function and save results to a file.
@@ -40,17 +60,18 @@ def analyze_profile(profile_file: str | Path) -> None:
     """
     Analyze a profile file and print detailed statistics.
     """
-    stats = pstats.Stats(profile_file)
-    stats.strip_dirs()
-    
-    print("\n=== Time Ordered ===")
-    stats.sort_stats('time').print_stats(20)
-    
-    print("\n=== Cumulative Time ===")
-    stats.sort_stats('cumulative').print_stats(20)
-    
-    print("\n=== Call Count ===")
-    stats.sort_stats('calls').print_stats(20)
-    
-    print("\n=== Function Name ===")
-    stats.sort_stats('name').print_stats(20)
+    # Collect all sections in a buffer, and print them in one go
+    output = StringIO()
+    stats = load_stats(profile_file)
+    stats.stream = output
+
+    for title, key in [
+        ("Time Ordered", "time"),
+        ("Cumulative Time", "cumulative"),
+        ("Call Count", "calls"),
+        ("Function Name", "name"),
+    ]:
+        print(f"\n=== {title} ===", file=output)
+        stats.sort_stats(key).print_stats(20)
+
+    print(output.getvalue(), end="")
@@ -26,6 +26,7 @@ logger = logging.getLogger(__name__)
 console = Console(log_path=False)
 
 
+@lru_cache(maxsize=None)
 def get_tokenizer(model: str):
     if "gpt-4" in model or "gpt-3.5" in model:
         return tiktoken.encoding_for_model(model)